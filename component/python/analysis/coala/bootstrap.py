@@ -7,6 +7,10 @@ import json
 import yaml
 
 REPO_PATH = 'git-repo'
+# directories that never hold the project's own sources
+SKIP_DIRS = frozenset(['.git', '.hg', '.svn', '__pycache__', '.venv', 'venv',
+                       'node_modules', '.tox', '.mypy_cache', 'build', 'dist',
+                       '.eggs'])
 
 
 def git_clone(url):
@@ -84,6 +88,7 @@ def main():
     use_yaml = argv.get('out-put-type', 'json') == 'yaml'
 
     for root, dirs, files in os.walk(REPO_PATH):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
         for file_name in files:
             if file_name.endswith('.py'):
                 o = coala(os.path.join(root, file_name), bears, use_yaml)
@@ -1,17 +1,35 @@
 #!/usr/bin/env python3
 
 import subprocess
+import asyncio
 import os
+import re
 import sys
 import json
+import importlib
 import yaml
+from collections import deque
 from security import safe_command
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'version', 'out-put-type'])
+# directories that never hold the project's own sources
+SKIP_DIRS = frozenset(['.git', '.hg', '.svn', '__pycache__', '.venv', 'venv',
+                       'node_modules', '.tox', '.mypy_cache', 'build', 'dist',
+                       '.eggs'])
+# keep each flake8 command line well below ARG_MAX
+FLAKE8_BATCH_SIZE = 1000
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if (r.returncode == 0):
         return True
@@ -28,8 +46,8 @@ def get_pip_cmd(version):
     return 'pip'
 
 
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'flake8'])
+def init_env(pip_cmd):
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'flake8'])
 
 
 def validate_version(version):
@@ -41,27 +59,90 @@ def validate_version(version):
     return True
 
 
-def flake8(file_name, use_yaml):
-    r = subprocess.run(['flake8', file_name], stderr=subprocess.PIPE,
-                       stdout=subprocess.PIPE)
+def flake8_api(paths):
+    # flake8 was installed by init_env after this interpreter started
+    importlib.invalidate_caches()
+    from flake8.api import legacy
+    from flake8.formatting.base import BaseFormatter
 
-    passed = True
-    if (r.returncode != 0):
-        passed = False
+    retval = []
+
+    class ResultFormatter(BaseFormatter):
+        def format(self, error):
+            retval.append({'file': trim_repo_path(error.filename),
+                           'line': str(error.line_number),
+                           'col': str(error.column_number),
+                           'msg': ' {} {}'.format(error.code, error.text)})
+
+    # flake8 spreads the files over its own process pool (jobs=auto,
+    # one worker per CPU), so the files are handed over in one call
+    guide = legacy.get_style_guide()
+    guide.init_report(ResultFormatter)
+    report = guide.check_files(paths)
+
+    return report.total_errors == 0, retval
+
+
+async def flake8_batch(sem, paths):
+    async with sem:
+        proc = await asyncio.create_subprocess_exec(
+            'flake8', '--jobs=1', '--', *paths,
+            stderr=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+        retval = []
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                break
+            o = parse_flake8_result(str(line, 'utf-8').rstrip('\n'))
+            if o:
+                retval.append(o)
+
+        return await proc.wait() == 0, retval
+
+
+async def flake8_batches(paths):
+    # one single-job flake8 per CPU, each on its own slice of the files
+    cpus = os.cpu_count() or 1
+    size = min(FLAKE8_BATCH_SIZE, max(1, -(-len(paths) // cpus)))
+    sem = asyncio.Semaphore(cpus)
+    return await asyncio.gather(*[flake8_batch(sem, paths[i:i + size])
+                                  for i in range(0, len(paths), size)])
+
+
+def flake8_cli(paths):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(flake8_batches(paths))
+    finally:
+        loop.close()
 
-    out = str(r.stdout, 'utf-8').strip().split('\n')
+    passed = True
     retval = []
-    for o in out:
-        o = parse_flake8_result(o)
-        if o:
-            retval.append(o)
+    for ok, batch in results:
+        passed = passed and ok
+        retval.extend(batch)
+
+    return passed, retval
+
+
+def flake8(paths, pip_cmd, use_yaml):
+    if not paths:
+        return True
 
+    # python2 targets get flake8 from pip2, which this python3 process
+    # cannot import, so only they go through the command line tool
+    if pip_cmd == 'pip3':
+        passed, retval = flake8_api(paths)
+    else:
+        passed, retval = flake8_cli(paths)
 
     if len(retval) > 0:
         out = {"results": { "cli": retval }}
         if use_yaml:
-            out = bytes(yaml.safe_dump(out), 'utf-8')
-            print('[COUT] CO_YAML_CONTENT {}'.format(str(out)[1:]))
+            # repr() keeps the document on the single [COUT] line
+            print('[COUT] CO_YAML_CONTENT {!r}'.format(yaml.dump(out, Dumper=SafeDumper)))
         else:
             print('[COUT] CO_JSON_CONTENT {}'.format(json.dumps(out)))
 
@@ -78,27 +159,30 @@ def trim_repo_path(n):
     return n[len(REPO_PATH) + 1:]
 
 
+def iter_py_files(root):
+    stack = deque([root])
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith('.py'):
+                yield entry.path
+
+
 def parse_argument():
     data = os.environ.get('CO_DATA', None)
     if not data:
         return {}
 
-    validate = ['git-url', 'version', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -117,21 +201,15 @@ def main():
         print("[COUT] CO_RESULT = false")
         return
 
-    init_env(version)
+    pip_cmd = get_pip_cmd(version)
+    init_env(pip_cmd)
 
     if not git_clone(git_url):
         return
 
-    all_true = True
     use_yaml = argv.get('out-put-type', 'json') == 'yaml'
 
-    for root, dirs, files in os.walk(REPO_PATH):
-        for file_name in files:
-            if file_name.endswith('.py'):
-                o = flake8(os.path.join(root, file_name), use_yaml)
-                all_true = all_true and o
-
-    if all_true:
+    if flake8(list(iter_py_files(REPO_PATH)), pip_cmd, use_yaml):
         print("[COUT] CO_RESULT = true")
     else:
         print("[COUT] CO_RESULT = false")
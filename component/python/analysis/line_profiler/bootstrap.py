@@ -2,20 +2,30 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
 import json
 import line_profiler as profiler
 import linecache
 import inspect
+import itertools
+import tokenize
 import yaml
 from security import safe_command
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-file', 'version', 'out-put-type'])
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if (r.returncode == 0):
         return True
@@ -39,8 +49,8 @@ def get_python_cmd(version):
     return 'python'
 
 
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'cython', 'line_profiler'])
+def init_env(pip_cmd):
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'cython', 'line_profiler'])
 
 
 def validate_version(version):
@@ -52,11 +62,10 @@ def validate_version(version):
     return True
 
 
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -65,8 +74,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root='.', depth=2):
+    # finds what ./*/setup.py ... ./*/*/requirements.txt would match,
+    # reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif level > 0 and entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif level > 0 and entry.name == 'requirements.txt':
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -81,14 +117,32 @@ def show_json(stats, unit):
     retval = {}
     retval['Timer unit'] = '%g s' % unit
     retval['functions'] = []
+    # Clear the cache once to ensure that we get up-to-date results; the
+    # sources don't change while the report is built.
+    linecache.clearcache()
+    exists = {fn: os.path.exists(fn) for fn, _, _ in stats}
     for (fn, lineno, name), timings in sorted(stats.items()):
-        func = show_func(fn, lineno, name, stats[fn, lineno, name], unit)
+        func = show_func(fn, lineno, name, timings, unit, exists[fn])
         if func:
             retval['functions'].append(func)
 
     return retval
 
-def show_func(filename, start_lineno, func_name, timings, unit):
+def getblock(lines, start_lineno):
+    """ Same as inspect.getblock(lines[start_lineno-1:]), without copying the
+    rest of the file for every function.
+    """
+    finder = inspect.BlockFinder()
+    source = itertools.islice(lines, start_lineno - 1, None)
+    try:
+        for token in tokenize.generate_tokens(source.__next__):
+            finder.tokeneater(*token)
+    except (inspect.EndOfBlock, IndentationError):
+        pass
+
+    return lines[start_lineno - 1:start_lineno - 1 + finder.last]
+
+def show_func(filename, start_lineno, func_name, timings, unit, exists):
     """ Show results for a single function.
     """
 
@@ -105,14 +159,11 @@ def show_func(filename, start_lineno, func_name, timings, unit):
     retval = {}
 
     retval['Total time'] = "%g s" % (total_time * unit)
-    if os.path.exists(filename) or filename.startswith("<ipython-input-"):
+    if exists or filename.startswith("<ipython-input-"):
         retval['File'] = filename
         retval['Function'] = '%s at line %s' % (func_name, start_lineno)
-        if os.path.exists(filename):
-            # Clear the cache to ensure that we get up-to-date results.
-            linecache.clearcache()
         all_lines = linecache.getlines(filename)
-        sublines = inspect.getblock(all_lines[start_lineno-1:])
+        sublines = getblock(all_lines, start_lineno)
     else:
         # Fake empty lines so we can see the timings, if not the code.
         nlines = max(linenos) - min(min(linenos), start_lineno) + 1
@@ -140,7 +191,7 @@ def show_func(filename, start_lineno, func_name, timings, unit):
     return retval
 
 def line_profiler(file_name, use_yaml):
-    r = subprocess.run(['kernprof', '-l', os.path.join(REPO_PATH, file_name)], stdout=subprocess.PIPE)
+    r = subprocess.run(['kernprof', '-l', os.path.join(REPO_PATH, file_name)], stdout=subprocess.DEVNULL)
 
     passed = True
     if (r.returncode != 0):
@@ -149,8 +200,8 @@ def line_profiler(file_name, use_yaml):
     st = profiler.load_stats('{}/{}.lprof'.format(REPO_PATH, file_name))
     out = show_json(st.timings, st.unit)
     if use_yaml:
-        out = bytes(yaml.safe_dump(out), 'utf-8')
-        print('[COUT] CO_YAML_CONTENT {}'.format(str(out)[1:]))
+        # repr() keeps the document on the single [COUT] line
+        print('[COUT] CO_YAML_CONTENT {!r}'.format(yaml.dump(out, Dumper=SafeDumper)))
     else:
         print('[COUT] CO_JSON_CONTENT {}'.format(json.dumps(out)))
 
@@ -166,22 +217,14 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-file', 'version', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -200,7 +243,8 @@ def main():
         print("[COUT] CO_RESULT = false")
         return
 
-    init_env(version)
+    pip_cmd, python_cmd = get_pip_cmd(version), get_python_cmd(version)
+    init_env(pip_cmd)
 
     entry_file = argv.get('entry-file')
     if not entry_file:
@@ -211,17 +255,13 @@ def main():
     if not git_clone(git_url):
         return
 
-    for file_name in glob.glob('./*/setup.py'):
-        setup(file_name, version)
-
-    for file_name in glob.glob('./*/*/setup.py'):
-        setup(file_name, version)
+    setups, reqs = discover()
 
-    for file_name in glob.glob('./*/requirements.txt'):
-        pip_install(file_name, version)
+    for file_name in setups:
+        setup(file_name, python_cmd)
 
-    for file_name in glob.glob('./*/*/requirements.txt'):
-        pip_install(file_name, version)
+    if reqs:
+        pip_install(reqs, pip_cmd)
 
     use_yaml = argv.get('out-put-type', 'json') == 'yaml'
 
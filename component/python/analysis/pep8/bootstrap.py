@@ -2,16 +2,37 @@
 
 import subprocess
 import os
+import re
 import sys
+import io
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
 import yaml
 from security import safe_command
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'version', 'out-put-type', 'fail-fast'])
+REPO_PREFIX_LEN = len(REPO_PATH) + 1
+# directories that never hold the project's own sources
+SKIP_DIRS = frozenset(['.git', '.hg', '.svn', '__pycache__', '.venv', 'venv',
+                       'node_modules', '.tox', '.mypy_cache', 'build', 'dist',
+                       '.eggs'])
+# keep each pep8 command line well below ARG_MAX
+PEP8_BATCH_SIZE = 1000
+# small slices in fail-fast mode, so a failure leaves most of them unstarted
+FAIL_FAST_BATCH_SIZE = 50
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if (r.returncode == 0):
         return True
@@ -28,8 +49,25 @@ def get_pip_cmd(version):
     return 'pip'
 
 
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'pep8'])
+def get_python_cmd(version):
+    if version == 'py3k' or version == 'python3':
+        return 'python3'
+
+    return 'python'
+
+
+def installed(python_cmd, module):
+    r = subprocess.run([python_cmd, '-c', 'import {}'.format(module)],
+                       stderr=subprocess.DEVNULL)
+    return r.returncode == 0
+
+
+def init_env(pip_cmd, python_cmd):
+    # skip pip's index round trip when the image already has the tool
+    if installed(python_cmd, 'pep8'):
+        return
+
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'pep8'])
 
 
 def validate_version(version):
@@ -41,25 +79,50 @@ def validate_version(version):
     return True
 
 
-def pep8(file_name, use_yaml):
-    r = subprocess.run(['pep8', file_name], stderr=subprocess.PIPE,
-                       stdout=subprocess.PIPE)
+def map_batches(fn, paths, batch_size, fail_fast=False):
+    # one linter process per CPU, each on its own slice of the files
+    cpus = os.cpu_count() or 1
+    size = min(batch_size, max(1, -(-len(paths) // cpus)))
+    with ThreadPoolExecutor(max_workers=cpus) as executor:
+        futures = [executor.submit(fn, paths[i:i + size])
+                   for i in range(0, len(paths), size)]
+        if not fail_fast:
+            return [f.result() for f in futures]
 
-    passed = True
-    if (r.returncode != 0):
-        passed = False
+        for f in as_completed(futures):
+            if not f.result()[0]:
+                for pending in futures:
+                    pending.cancel()
+                break
+
+        # report every slice that did run, in file order
+        return [f.result() for f in futures if not f.cancelled()]
 
-    out = str(r.stdout, 'utf-8').strip().split('\n')
+
+def pep8_batch(paths):
+    with subprocess.Popen(['pep8'] + paths, stderr=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE) as proc:
+        retval = []
+        for line in io.TextIOWrapper(proc.stdout, encoding='utf-8'):
+            o = parse_pep8_result(line.rstrip('\n'))
+            if o:
+                retval.append(o)
+
+    return proc.returncode == 0, retval
+
+
+def pep8(paths, use_yaml, fail_fast=False):
+    passed = True
     retval = []
-    for o in out:
-        o = parse_pep8_result(o)
-        if o:
-            retval.append(o)
+    batch_size = FAIL_FAST_BATCH_SIZE if fail_fast else PEP8_BATCH_SIZE
+    for ok, batch in map_batches(pep8_batch, paths, batch_size, fail_fast):
+        passed = passed and ok
+        retval.extend(batch)
 
     if len(retval) > 0:
         out = {"results": { "cli": retval }}
         if use_yaml:
-            out = bytes(yaml.safe_dump(out), 'utf-8')
+            out = bytes(yaml.dump(out, Dumper=SafeDumper), 'utf-8')
             print('[COUT] CO_YAML_CONTENT {}'.format(str(out)[1:]))
         else:
             print('[COUT] CO_JSON_CONTENT {}'.format(json.dumps(out)))
@@ -68,13 +131,24 @@ def pep8(file_name, use_yaml):
 
 
 def parse_pep8_result(line):
-    line = line.split(':')
+    line = line.split(':', 3)
     if (len(line) < 4):
         return False
     return {'file': trim_repo_path(line[0]), 'line': line[1], 'col': line[2], 'msg': line[3]}
 
 def trim_repo_path(n):
-    return n[len(REPO_PATH) + 1:]
+    return n[REPO_PREFIX_LEN:]
+
+
+def iter_py_files(root):
+    stack = deque([root])
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith('.py'):
+                yield entry.path
 
 
 def parse_argument():
@@ -82,22 +156,14 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'version', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -116,21 +182,17 @@ def main():
         print("[COUT] CO_RESULT = false")
         return
 
-    init_env(version)
+    pip_cmd, python_cmd = get_pip_cmd(version), get_python_cmd(version)
+    init_env(pip_cmd, python_cmd)
 
     if not git_clone(git_url):
         return
 
-    all_true = True
     use_yaml = argv.get('out-put-type', 'json') == 'yaml'
+    fail_fast = argv.get('fail-fast', 'false') == 'true'
+    paths = list(iter_py_files(REPO_PATH))
 
-    for root, dirs, files in os.walk(REPO_PATH):
-        for file_name in files:
-            if file_name.endswith('.py'):
-                o = pep8(os.path.join(root, file_name), use_yaml)
-                all_true = all_true and o
-
-    if all_true:
+    if pep8(paths, use_yaml, fail_fast):
         print("[COUT] CO_RESULT = true")
     else:
         print("[COUT] CO_RESULT = false")
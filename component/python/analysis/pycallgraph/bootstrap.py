@@ -2,15 +2,20 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
+import http.client
+import urllib.request
 from security import safe_command
 
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-file', 'upload', 'version'])
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -35,8 +40,18 @@ def get_python_cmd(version):
     return 'python'
 
 
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'pycallgraph'])
+def installed(python_cmd, module):
+    r = subprocess.run([python_cmd, '-c', 'import {}'.format(module)],
+                       stderr=subprocess.DEVNULL)
+    return r.returncode == 0
+
+
+def init_env(pip_cmd, python_cmd):
+    # skip pip's index round trip when the image already has the tool
+    if installed(python_cmd, 'pycallgraph'):
+        return
+
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'pycallgraph'])
 
 
 def validate_version(version):
@@ -48,11 +63,10 @@ def validate_version(version):
     return True
 
 
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -61,8 +75,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root='.', depth=2):
+    # finds what ./*/setup.py ... ./*/*/requirements.txt would match,
+    # reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif level > 0 and entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif level > 0 and entry.name == 'requirements.txt':
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -79,8 +120,12 @@ def pycallgraph(file_name, upload):
         print("[COUT] pycallgraph error", file=sys.stderr)
         return False
 
-    r1 = subprocess.run(['curl', '-XPUT', '-d', '@pycallgraph.png', upload])
-    if r1.returncode != 0:
+    try:
+        with open('pycallgraph.png', 'rb') as f:
+            req = urllib.request.Request(upload, data=f, method='PUT', headers={
+                'Content-Length': str(os.fstat(f.fileno()).st_size)})
+            urllib.request.urlopen(req).close()
+    except (OSError, ValueError, http.client.HTTPException):
         print("[COUT] upload error", file=sys.stderr)
         return False
     return True
@@ -91,22 +136,14 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-file', 'upload', 'version']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -125,7 +162,8 @@ def main():
         print("[COUT] CO_RESULT = false")
         return
 
-    init_env(version)
+    pip_cmd, python_cmd = get_pip_cmd(version), get_python_cmd(version)
+    init_env(pip_cmd, python_cmd)
 
     entry_file = argv.get('entry-file')
     if not entry_file:
@@ -142,20 +180,15 @@ def main():
     if not git_clone(git_url):
         return
 
-    for file_name in glob.glob('./*/setup.py'):
-        setup(file_name, version)
-
-    for file_name in glob.glob('./*/*/setup.py'):
-        setup(file_name, version)
+    setups, reqs = discover()
 
-    for file_name in glob.glob('./*/requirements.txt'):
-        pip_install(file_name, version)
+    for file_name in setups:
+        setup(file_name, python_cmd)
 
-    for file_name in glob.glob('./*/*/requirements.txt'):
-        pip_install(file_name, version)
+    if reqs:
+        pip_install(reqs, pip_cmd)
 
     out = pycallgraph(entry_file, upload)
-    print()
 
     if out:
         print("[COUT] CO_RESULT = true")
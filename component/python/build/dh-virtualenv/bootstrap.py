@@ -2,15 +2,27 @@
 
 import subprocess
 import os
+import re
 import sys
 import glob
+import http.client
+import urllib.request
 from security import safe_command
 
 REPO_PATH = 'git-repo'
+# git clone options for each clone-mode; a full clone keeps the history and
+# tags that version-from-git build steps rely on
+CLONE_ARGS = {
+    'shallow': ['--depth=1', '--single-branch'],
+    'full': [],
+}
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['clone-mode', 'git-url', 'entry-file', 'upload'])
 
 
-def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+def git_clone(url, mode='shallow'):
+    r = subprocess.run(['git', 'clone'] + CLONE_ARGS[mode] + [url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -23,16 +35,22 @@ def git_clone(url):
 
 def upload_file(upload):
     file_name = glob.glob('*.deb')[0]
-    r1 = subprocess.run(['curl', '-XPUT', '-d', '@' + file_name, upload])
-    if r1.returncode != 0:
+    try:
+        with open(file_name, 'rb') as f:
+            req = urllib.request.Request(upload, data=f, method='PUT', headers={
+                'Content-Length': str(os.fstat(f.fileno()).st_size)})
+            urllib.request.urlopen(req).close()
+    except (OSError, ValueError, http.client.HTTPException):
         print("[COUT] upload error", file=sys.stderr)
         return False
-    print()
     return True
 
 
 def build():
-    r = safe_command.run(subprocess.run, 'cd {}; yes | mk-build-deps -ri; dpkg-buildpackage -us -uc -b'.format(REPO_PATH), shell=False)
+    # as before, a failed build-deps install is left for dpkg-buildpackage to report
+    safe_command.run(subprocess.run, ['mk-build-deps', '-ri', '-t', 'apt-get -y --no-install-recommends'],
+                     cwd=REPO_PATH)
+    r = safe_command.run(subprocess.run, ['dpkg-buildpackage', '-us', '-uc', '-b'], cwd=REPO_PATH)
 
     if r.returncode != 0:
         print("[COUT] build error", file=sys.stderr)
@@ -46,22 +64,14 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-file', 'upload']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -74,13 +84,19 @@ def main():
         print("[COUT] CO_RESULT = false")
         return
 
+    clone_mode = argv.get('clone-mode', 'shallow')
+    if clone_mode not in CLONE_ARGS:
+        print("[COUT] Check clone-mode failed: the valid clone-mode is {}".format(sorted(CLONE_ARGS)), file=sys.stderr)
+        print("[COUT] CO_RESULT = false")
+        return
+
     upload = argv.get('upload')
     if not upload:
         print("[COUT] The upload value is null", file=sys.stderr)
         print("[COUT] CO_RESULT = false")
         return
 
-    if not git_clone(git_url):
+    if not git_clone(git_url, clone_mode):
         return
 
     if not build():
@@ -94,4 +110,5 @@ def main():
     print("[COUT] CO_RESULT = true")
 
 
-main()
+if __name__ == '__main__':
+    main()
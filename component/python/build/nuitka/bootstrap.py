@@ -2,15 +2,34 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
+import http.client
+import urllib.request
 from security import safe_command
 
 REPO_PATH = 'git-repo'
-
-
-def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+# git clone options for each clone-mode; a full clone keeps the history and
+# tags that version-from-git build steps rely on
+CLONE_ARGS = {
+    'shallow': ['--depth=1', '--single-branch'],
+    'full': [],
+}
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['clone-mode', 'git-url', 'entry-file', 'upload', 'version'])
+# version -> (python, pip) commands
+VERSION_CMDS = {
+    'py3k': ('python3', 'pip3'),
+    'python3': ('python3', 'pip3'),
+    'python2': ('python', 'pip'),
+    'python': ('python', 'pip'),
+}
+TOOL_PACKAGES = ['nuitka']
+
+
+def git_clone(url, mode='shallow'):
+    r = subprocess.run(['git', 'clone'] + CLONE_ARGS[mode] + [url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -21,38 +40,14 @@ def git_clone(url):
         return False
 
 
-def get_pip_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'pip3'
-
-    return 'pip'
-
-
-def get_python_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'python3'
-
-    return 'python'
-
-
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'nuitka'])
+def init_env(pip_cmd):
+    safe_command.run(subprocess.run, [pip_cmd, 'install'] + TOOL_PACKAGES)
 
 
-def validate_version(version):
-    valid_version = ['python', 'python2', 'python3', 'py3k']
-    if version not in valid_version:
-        print("[COUT] Check version failed: the valid version is {}".format(valid_version), file=sys.stderr)
-        return False
-
-    return True
-
-
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -61,8 +56,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root=REPO_PATH, depth=1):
+    # finds what REPO_PATH/setup.py ... REPO_PATH/*/requirements.txt would
+    # match, reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif entry.name == 'requirements.txt':
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -71,24 +93,55 @@ def pip_install(file_name, version='py3k'):
     return True
 
 
+def install(setups, reqs, python_cmd='python3', pip_cmd='pip3'):
+    # the tool, the requirements files and the repository's own projects
+    # go through one pip run, so the dependency set is resolved once
+    cmd = [pip_cmd, 'install'] + TOOL_PACKAGES
+    for file_name in reqs:
+        cmd += ['-r', file_name]
+    # absolute paths, since pip would read a bare 'git-repo' as a package name
+    cmd += [os.path.abspath(os.path.dirname(file_name)) for file_name in setups]
+    r = safe_command.run(subprocess.run, cmd)
+    if r.returncode == 0:
+        return
+
+    # one broken piece fails the whole run; install them one by one so
+    # the rest still lands
+    print("[COUT] install dependences failed, retrying step by step", file=sys.stderr)
+    init_env(pip_cmd)
+    for file_name in setups:
+        setup(file_name, python_cmd)
+    if reqs:
+        pip_install(reqs, pip_cmd)
+
+
 def upload_file(file_name, upload):
-    bn = os.path.basename(file_name)[:-3]
-    r1 = subprocess.run(['curl', '-XPUT', '-d', '@' + bn + '.exe', upload])
-    if r1.returncode != 0:
+    try:
+        with open(file_name, 'rb') as f:
+            req = urllib.request.Request(upload, data=f, method='PUT', headers={
+                'Content-Length': str(os.fstat(f.fileno()).st_size)})
+            urllib.request.urlopen(req).close()
+    except (OSError, ValueError, http.client.HTTPException):
         print("[COUT] upload error", file=sys.stderr)
         return False
     return True
 
 
 def nuitka(file_name):
-    r = subprocess.run(['nuitka', '--recurse-all',
+    # name the binary ourselves; nuitka's default suffix differs by
+    # version and platform
+    out_path = os.path.splitext(os.path.basename(file_name))[0] + '.bin'
+    # --jobs spreads the C backend compile over all CPUs
+    r = subprocess.run(['nuitka', '--follow-imports',
+                        '--jobs={}'.format(os.cpu_count() or 1),
+                        '-o', out_path,
                         '{}/{}'.format(REPO_PATH, file_name)])
 
     if r.returncode != 0:
         print("[COUT] nuitka error", file=sys.stderr)
-        return False
+        return None
 
-    return True
+    return out_path
 
 
 def parse_argument():
@@ -96,41 +149,40 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-file', 'upload', 'version']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
+        if key == 'version' and value not in VERSION_CMDS:
+            print("[COUT] Check version failed: the valid version is {}".format(sorted(VERSION_CMDS)), file=sys.stderr)
+            return None
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
 
 def main():
     argv = parse_argument()
+    if argv is None:
+        print("[COUT] CO_RESULT = false")
+        return
+
     git_url = argv.get('git-url')
     if not git_url:
         print("[COUT] The git-url value is null", file=sys.stderr)
         print("[COUT] CO_RESULT = false")
         return
 
-    version = argv.get('version', 'py3k')
-
-    if not validate_version(version):
+    clone_mode = argv.get('clone-mode', 'shallow')
+    if clone_mode not in CLONE_ARGS:
+        print("[COUT] Check clone-mode failed: the valid clone-mode is {}".format(sorted(CLONE_ARGS)), file=sys.stderr)
         print("[COUT] CO_RESULT = false")
         return
 
-    init_env(version)
+    version = argv.get('version', 'py3k')
 
     entry_file = argv.get('entry-file')
     if not entry_file:
@@ -144,27 +196,19 @@ def main():
         print("[COUT] CO_RESULT = false")
         return
 
-    if not git_clone(git_url):
+    if not git_clone(git_url, clone_mode):
         return
 
-    for file_name in glob.glob('{}/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/*/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/*/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    setups, reqs = discover()
+    python_cmd, pip_cmd = VERSION_CMDS[version]
+    install(setups, reqs, python_cmd, pip_cmd)
 
-    if not nuitka(entry_file):
+    artifact = nuitka(entry_file)
+    if not artifact:
         print("[COUT] CO_RESULT = false")
         return
 
-    out = upload_file(entry_file, upload)
-    print()
+    out = upload_file(artifact, upload)
     if not out:
         print("[COUT] CO_RESULT = false")
         return
@@ -172,4 +216,5 @@ def main():
     print("[COUT] CO_RESULT = true")
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,34 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
 import json
-import anymarkup
+from collections import deque
 from security import safe_command
 
 REPO_PATH = 'git-repo'
-
-
-def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+# git clone options for each clone-mode; a full clone keeps the history and
+# tags that version-from-git build steps rely on
+CLONE_ARGS = {
+    'shallow': ['--depth=1', '--single-branch'],
+    'full': [],
+}
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['clone-mode', 'git-url', 'entry-path', 'task', 'version', 'out-put-type'])
+# version -> (python, pip) commands
+VERSION_CMDS = {
+    'py3k': ('python3', 'pip3'),
+    'python3': ('python3', 'pip3'),
+    'python2': ('python', 'pip'),
+    'python': ('python', 'pip'),
+}
+TOOL_PACKAGES = ['pybuilder', 'six']
+
+
+def git_clone(url, mode='shallow'):
+    r = subprocess.run(['git', 'clone'] + CLONE_ARGS[mode] + [url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -23,38 +40,14 @@ def git_clone(url):
         return False
 
 
-def get_pip_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'pip3'
-
-    return 'pip'
-
-
-def get_python_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'python3'
-
-    return 'python'
-
-
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'pybuilder', 'six'])
-
-
-def validate_version(version):
-    valid_version = ['python', 'python2', 'python3', 'py3k']
-    if version not in valid_version:
-        print("[COUT] Check version failed: the valid version is {}".format(valid_version), file=sys.stderr)
-        return False
-
-    return True
+def init_env(pip_cmd):
+    safe_command.run(subprocess.run, [pip_cmd, 'install'] + TOOL_PACKAGES)
 
 
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -63,8 +56,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root=REPO_PATH, depth=1):
+    # finds what REPO_PATH/setup.py ... REPO_PATH/*/requirements.txt would
+    # match, reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif entry.name == 'requirements.txt':
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -73,13 +93,38 @@ def pip_install(file_name, version='py3k'):
     return True
 
 
+def install(setups, reqs, python_cmd='python3', pip_cmd='pip3'):
+    # the tool, the requirements files and the repository's own projects
+    # go through one pip run, so the dependency set is resolved once
+    cmd = [pip_cmd, 'install'] + TOOL_PACKAGES
+    for file_name in reqs:
+        cmd += ['-r', file_name]
+    # absolute paths, since pip would read a bare 'git-repo' as a package name
+    cmd += [os.path.abspath(os.path.dirname(file_name)) for file_name in setups]
+    r = safe_command.run(subprocess.run, cmd)
+    if r.returncode == 0:
+        return
+
+    # one broken piece fails the whole run; install them one by one so
+    # the rest still lands
+    print("[COUT] install dependences failed, retrying step by step", file=sys.stderr)
+    init_env(pip_cmd)
+    for file_name in setups:
+        setup(file_name, python_cmd)
+    if reqs:
+        pip_install(reqs, pip_cmd)
+
+
 def pybuilder(dir_name, task):
     if dir_name and dir_name != '.':
         dir_name = '{}/{}'.format(REPO_PATH, dir_name)
     else:
         dir_name = REPO_PATH
 
-    r = safe_command.run(subprocess.run, 'cd {}; pyb {}'.format(dir_name, task), shell=False)
+    cmd = ['pyb']
+    if task:
+        cmd.append(task)
+    r = safe_command.run(subprocess.run, cmd, cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] pybuilder error", file=sys.stderr)
@@ -88,40 +133,69 @@ def pybuilder(dir_name, task):
     return True
 
 
+def iter_files(root, suffix):
+    if not os.path.isdir(root):
+        return
+
+    stack = deque([root])
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith(suffix):
+                yield entry.path
+
+
 def echo_json(dir_name, use_yaml):
+    # yaml is only needed, and imported, for yaml output
+    if use_yaml:
+        import yaml
+        try:
+            from yaml import CSafeDumper as SafeDumper
+        except ImportError:
+            from yaml import SafeDumper
+
     if dir_name and dir_name != '.':
         dir_name = '{}/{}'.format(REPO_PATH, dir_name)
     else:
         dir_name = REPO_PATH
-    for root, dirs, files in os.walk('{}/target'.format(dir_name)):
-        for file_name in files:
-            if file_name.endswith('.json'):
-                data = json.load(open(os.path.join(root, file_name)))
-                if use_yaml:
-                    data = anymarkup.serialize(data, 'yaml')
-                    print('[COUT] CO_YAML_CONTENT {}'.format(str(data)[1:]))
-                else:
-                    print('[COUT] CO_JSON_CONTENT {}'.format(json.dumps(data)))
-
+    # one write for all reports instead of one per file
+    out = []
+    for path in iter_files('{}/target'.format(dir_name), '.json'):
+        with open(path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+        if use_yaml:
+            data = yaml.dump(data, Dumper=SafeDumper, encoding='utf-8',
+                             default_flow_style=False)
+            out.append('[COUT] CO_YAML_CONTENT {}\n'.format(str(data)[1:]))
+        else:
+            out.append('[COUT] CO_JSON_CONTENT {}\n'.format(json.dumps(data)))
+
+    sys.stdout.write(''.join(out))
+    sys.stdout.flush()
     return True
 
 def echo_xml(dir_name, use_yaml):
+    if use_yaml:
+        import anymarkup
+
     if dir_name and dir_name != '.':
         dir_name = '{}/{}'.format(REPO_PATH, dir_name)
     else:
         dir_name = REPO_PATH
-    for root, dirs, files in os.walk('{}/target'.format(dir_name)):
-        for file_name in files:
-            if file_name.endswith('.xml'):
-                if use_yaml:
-                    data = anymarkup.parse_file(os.path.join(root, file_name))
-                    data = anymarkup.serialize(data, 'yaml')
-                    print('[COUT] CO_YAML_CONTENT {}'.format(str(data)[1:]))
-                    continue
-                with open(os.path.join(root, file_name), 'rb') as f:
-                    data = f.read()
-                    print('[COUT] CO_XML_CONTENT {}'.format(str(data)[1:]))
+    out = []
+    for path in iter_files('{}/target'.format(dir_name), '.xml'):
+        if use_yaml:
+            data = anymarkup.parse_file(path)
+            data = anymarkup.serialize(data, 'yaml')
+            out.append('[COUT] CO_YAML_CONTENT {}\n'.format(str(data)[1:]))
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+            out.append('[COUT] CO_XML_CONTENT {}\n'.format(str(data)[1:]))
 
+    sys.stdout.write(''.join(out))
+    sys.stdout.flush()
     return True
 
 
@@ -130,59 +204,50 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-path', 'task', 'version', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
+        if key == 'version' and value not in VERSION_CMDS:
+            print("[COUT] Check version failed: the valid version is {}".format(sorted(VERSION_CMDS)), file=sys.stderr)
+            return None
 
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
 
 def main():
     argv = parse_argument()
+    if argv is None:
+        print("[COUT] CO_RESULT = false")
+        return
+
     git_url = argv.get('git-url')
     if not git_url:
         print("[COUT] The git-url value is null", file=sys.stderr)
         print("[COUT] CO_RESULT = false")
         return
 
-    version = argv.get('version', 'py3k')
-
-    if not validate_version(version):
+    clone_mode = argv.get('clone-mode', 'shallow')
+    if clone_mode not in CLONE_ARGS:
+        print("[COUT] Check clone-mode failed: the valid clone-mode is {}".format(sorted(CLONE_ARGS)), file=sys.stderr)
         print("[COUT] CO_RESULT = false")
         return
 
-    init_env(version)
+    version = argv.get('version', 'py3k')
 
     entry_path = argv.get('entry-path', '.')
     task = argv.get('task')
 
-    if not git_clone(git_url):
+    if not git_clone(git_url, clone_mode):
         return
 
-    for file_name in glob.glob('{}/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/*/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/*/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    setups, reqs = discover()
+    python_cmd, pip_cmd = VERSION_CMDS[version]
+    install(setups, reqs, python_cmd, pip_cmd)
 
     out = pybuilder(entry_path, task)
     use_yaml = argv.get('out-put-type', 'json') == 'yaml'
@@ -196,4 +261,5 @@ def main():
         print("[COUT] CO_RESULT = true")
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,30 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
+import http.client
+import urllib.request
 from security import safe_command
 
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-file', 'upload', 'version'])
+# version -> (python, pip) commands
+VERSION_CMDS = {
+    'py3k': ('python3', 'pip3'),
+    'python3': ('python3', 'pip3'),
+    'python2': ('python', 'pip'),
+    'python': ('python', 'pip'),
+}
+# pyinstaller's analysis results; it redoes only what changed when this
+# directory is kept on a volume between runs
+WORK_PATH = '/var/cache/pyinstaller/build'
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -21,38 +36,14 @@ def git_clone(url):
         return False
 
 
-def get_pip_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'pip3'
+def init_env(pip_cmd):
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'pyinstaller'])
 
-    return 'pip'
 
-
-def get_python_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'python3'
-
-    return 'python'
-
-
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'pyinstaller'])
-
-
-def validate_version(version):
-    valid_version = ['python', 'python2', 'python3', 'py3k']
-    if version not in valid_version:
-        print("[COUT] Check version failed: the valid version is {}".format(valid_version), file=sys.stderr)
-        return False
-
-    return True
-
-
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -61,8 +52,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root=REPO_PATH, depth=1):
+    # finds what REPO_PATH/setup.py ... REPO_PATH/*/requirements.txt would
+    # match, reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif entry.name == 'requirements.txt':
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -72,16 +90,20 @@ def pip_install(file_name, version='py3k'):
 
 
 def upload_file(upload):
-    r1 = subprocess.run(['curl', '-XPUT', '-d', '@/tmp/output.tar.bz2', upload])
-    if r1.returncode != 0:
+    try:
+        with open('/tmp/output.tar.bz2', 'rb') as f:
+            req = urllib.request.Request(upload, data=f, method='PUT', headers={
+                'Content-Length': str(os.fstat(f.fileno()).st_size)})
+            urllib.request.urlopen(req).close()
+    except (OSError, ValueError, http.client.HTTPException):
         print("[COUT] upload error", file=sys.stderr)
         return False
-    print()
     return True
 
 
 def pyinstaller(file_name):
-    r = subprocess.run(['pyinstaller', '{}/{}'.format(REPO_PATH, file_name)])
+    r = subprocess.run(['pyinstaller', '--workpath', WORK_PATH,
+                        '{}/{}'.format(REPO_PATH, file_name)])
 
     if r.returncode != 0:
         print("[COUT] pyinstaller error", file=sys.stderr)
@@ -91,7 +113,9 @@ def pyinstaller(file_name):
 
 
 def compress():
-    r = subprocess.run('cd dist; tar cjvf /tmp/output.tar.bz2 .', shell=True)
+    # pbzip2 compresses on every CPU and still writes a .bz2 archive
+    r = subprocess.run(['tar', '--use-compress-program=pbzip2',
+                        '-cf', '/tmp/output.tar.bz2', '.'], cwd='dist')
 
     if r.returncode != 0:
         print("[COUT] compress error", file=sys.stderr)
@@ -105,28 +129,27 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-file', 'upload', 'version']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
+        if key == 'version' and value not in VERSION_CMDS:
+            print("[COUT] Check version failed: the valid version is {}".format(sorted(VERSION_CMDS)), file=sys.stderr)
+            return None
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
 
 def main():
     argv = parse_argument()
+    if argv is None:
+        print("[COUT] CO_RESULT = false")
+        return
+
     git_url = argv.get('git-url')
     if not git_url:
         print("[COUT] The git-url value is null", file=sys.stderr)
@@ -134,12 +157,8 @@ def main():
         return
 
     version = argv.get('version', 'py3k')
-
-    if not validate_version(version):
-        print("[COUT] CO_RESULT = false")
-        return
-
-    init_env(version)
+    python_cmd, pip_cmd = VERSION_CMDS[version]
+    init_env(pip_cmd)
 
     entry_file = argv.get('entry-file')
     if not entry_file:
@@ -156,17 +175,14 @@ def main():
     if not git_clone(git_url):
         return
 
-    for file_name in glob.glob('{}/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/*/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
+    setups, reqs = discover()
 
-    for file_name in glob.glob('{}/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    for file_name in setups:
+        setup(file_name, python_cmd)
 
-    for file_name in glob.glob('{}/*/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    # one pip run resolves all requirement files together
+    if reqs:
+        pip_install(reqs, pip_cmd)
 
     if not pyinstaller(entry_file):
         print("[COUT] CO_RESULT = false")
@@ -183,4 +199,5 @@ def main():
     print("[COUT] CO_RESULT = true")
 
 
-main()
+if __name__ == '__main__':
+    main()
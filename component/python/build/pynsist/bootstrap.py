@@ -2,15 +2,21 @@
 
 import subprocess
 import os
+import re
 import sys
 import glob
+import http.client
+import urllib.request
 from security import safe_command
 
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-file', 'upload'])
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -24,8 +30,7 @@ def git_clone(url):
 def setup(path):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; python3 {} install'.format(dir_name, file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, ['python3', file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed: {}".format(path), file=sys.stderr)
@@ -45,9 +50,12 @@ def pip_install(file_name):
 
 
 def upload_file(upload):
-    r1 = subprocess.run(['curl', '-XPUT', '-d', '@/tmp/output.tar.bz2', upload])
-    print()
-    if r1.returncode != 0:
+    try:
+        with open('/tmp/output.tar.bz2', 'rb') as f:
+            req = urllib.request.Request(upload, data=f, method='PUT', headers={
+                'Content-Length': str(os.fstat(f.fileno()).st_size)})
+            urllib.request.urlopen(req).close()
+    except (OSError, ValueError, http.client.HTTPException):
         print("[COUT] upload error", file=sys.stderr)
         return False
     return True
@@ -65,7 +73,10 @@ def pynsist(file_name):
 
 def compress(file_name):
     dirname = os.path.dirname(file_name)
-    r = safe_command.run(subprocess.run, 'cd {}/{}/build/nsis; tar cjvf /tmp/output.tar.bz2 .'.format(REPO_PATH, dirname), shell=False)
+    # pbzip2 compresses on every CPU and still writes a .bz2 archive
+    r = subprocess.run(['tar', '--use-compress-program=pbzip2',
+                        '-cf', '/tmp/output.tar.bz2', '.'],
+                       cwd=os.path.join(REPO_PATH, dirname, 'build', 'nsis'))
 
     if r.returncode != 0:
         print("[COUT] compress error", file=sys.stderr)
@@ -79,22 +90,14 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-file', 'upload']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -137,4 +140,5 @@ def main():
     print("[COUT] CO_RESULT = true")
 
 
-main()
+if __name__ == '__main__':
+    main()
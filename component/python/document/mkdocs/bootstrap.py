@@ -2,16 +2,26 @@
 
 import subprocess
 import os
+import re
 import sys
 import json
-import anymarkup
+from collections import deque
+import yaml
 from security import safe_command
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-path', 'out-put-type'])
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -23,7 +33,7 @@ def git_clone(url):
 
 
 def mkdocs(dir_name):
-    r = safe_command.run(subprocess.run, 'cd {}/{}; mkdocs json'.format(REPO_PATH, dir_name), shell=False)
+    r = safe_command.run(subprocess.run, ['mkdocs', 'json'], cwd=os.path.join(REPO_PATH, dir_name))
 
     if r.returncode != 0:
         print("[COUT] mkdocs error", file=sys.stderr)
@@ -32,17 +42,31 @@ def mkdocs(dir_name):
     return True
 
 
-def echo_json(dir_name, use_yaml):
-    for root, dirs, files in os.walk('{}/{}'.format(REPO_PATH, dir_name)):
-        for file_name in files:
-            if file_name.endswith('.json'):
-                data = json.load(open(os.path.join(root, file_name)))
-                if use_yaml:
-                    data = anymarkup.serialize(data, 'yaml')
-                    print('[COUT] CO_YAML_CONTENT {}'.format(str(data)[1:]))
-                else:
-                    print('[COUT] CO_JSON_CONTENT {}'.format(json.dumps(data)))
+def iter_files(root, suffix):
+    stack = deque([root])
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith(suffix):
+                yield entry.path
 
+
+def echo_json(dir_name, use_yaml):
+    # one write for all files instead of one per file
+    out = []
+    for path in iter_files('{}/{}'.format(REPO_PATH, dir_name), '.json'):
+        with open(path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+        if use_yaml:
+            data = yaml.dump(data, Dumper=SafeDumper, encoding='utf-8',
+                             default_flow_style=False)
+            out.append('[COUT] CO_YAML_CONTENT {}\n'.format(str(data)[1:]))
+        else:
+            out.append('[COUT] CO_JSON_CONTENT {}\n'.format(json.dumps(data)))
+
+    sys.stdout.write(''.join(out))
+    sys.stdout.flush()
     return True
 
 
@@ -51,22 +75,14 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-path', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -2,18 +2,46 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
+import time
+import random
 import anymarkup
 from security import safe_command
 
 REPO_PATH = 'git-repo'
-
-
-def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
-
-    if r.returncode == 0:
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-path', 'version', 'out-put-type'])
+# version -> (python, pip) commands
+VERSION_CMDS = {
+    'py3k': ('python3', 'pip3'),
+    'python3': ('python3', 'pip3'),
+    'python2': ('python', 'pip'),
+    'python': ('python', 'pip'),
+}
+# extra clone attempts, with backoff, for flaky networks
+CLONE_RETRIES = 2
+
+
+def clone_args(url):
+    return ['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH]
+
+
+def start_clone(url):
+    return subprocess.Popen(clone_args(url))
+
+
+def finish_clone(proc, url):
+    returncode = proc.wait()
+    # git removes the directory of a failed clone, so just run it again
+    for attempt in range(CLONE_RETRIES):
+        if returncode == 0:
+            break
+        time.sleep(2 ** attempt + random.random())
+        returncode = subprocess.run(clone_args(url)).returncode
+
+    if returncode == 0:
         return True
     else:
         print("[COUT] Git clone error: Invalid argument to exit",
@@ -22,38 +50,14 @@ def git_clone(url):
         return False
 
 
-def get_pip_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'pip3'
-
-    return 'pip'
-
-
-def get_python_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'python3'
-
-    return 'python'
-
-
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'coverage'])
-
-
-def validate_version(version):
-    valid_version = ['python', 'python2', 'python3', 'py3k']
-    if version not in valid_version:
-        print("[COUT] Check version failed: the valid version is {}".format(valid_version), file=sys.stderr)
-        return False
-
-    return True
+def init_env(pip_cmd):
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'coverage'])
 
 
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -62,8 +66,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root=REPO_PATH, depth=1):
+    # finds what REPO_PATH/setup.py ... REPO_PATH/*/requirements_dev.txt would
+    # match, reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif entry.name in ('requirements.txt', 'requirements_dev.txt'):
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -73,7 +104,7 @@ def pip_install(file_name, version='py3k'):
 
 
 def coverage(file_name):
-    r = safe_command.run(subprocess.run, 'cd {}; coverage xml -o /tmp/output.xml {}'.format(REPO_PATH, file_name), shell=False)
+    r = safe_command.run(subprocess.run, ['coverage', 'xml', '-o', '/tmp/output.xml', file_name], cwd=REPO_PATH)
 
     if r.returncode != 0:
         return False
@@ -100,28 +131,27 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-path', 'version', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
+        if key == 'version' and value not in VERSION_CMDS:
+            print("[COUT] Check version failed: the valid version is {}".format(sorted(VERSION_CMDS)), file=sys.stderr)
+            return None
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
 
 def main():
     argv = parse_argument()
+    if argv is None:
+        print("[COUT] CO_RESULT = false")
+        return
+
     git_url = argv.get('git-url')
     if not git_url:
         print("[COUT] The git-url value is null", file=sys.stderr)
@@ -129,12 +159,7 @@ def main():
         return
 
     version = argv.get('version', 'py3k')
-
-    if not validate_version(version):
-        print("[COUT] CO_RESULT = false")
-        return
-
-    init_env(version)
+    python_cmd, pip_cmd = VERSION_CMDS[version]
 
     entry_path = argv.get('entry-path')
     if not entry_path:
@@ -142,27 +167,20 @@ def main():
         print("[COUT] CO_RESULT = false")
         return
 
-    if not git_clone(git_url):
+    # the clone and the tool install are both network bound; overlap them
+    clone = start_clone(git_url)
+    init_env(pip_cmd)
+    if not finish_clone(clone, git_url):
         return
 
-    for file_name in glob.glob('{}/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/*/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/*/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/requirements_dev.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    setups, reqs = discover()
 
-    for file_name in glob.glob('{}/*/requirements_dev.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    for file_name in setups:
+        setup(file_name, python_cmd)
 
+    # one pip run resolves all requirement files together
+    if reqs:
+        pip_install(reqs, pip_cmd)
 
     out = coverage(entry_path)
 
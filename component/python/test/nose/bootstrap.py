@@ -2,18 +2,31 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
 import anymarkup
 from security import safe_command
 
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-path', 'version', 'out-put-type',
+                        'continue-on-error'])
+# version -> (python, pip) commands
+VERSION_CMDS = {
+    'py3k': ('python3', 'pip3'),
+    'python3': ('python3', 'pip3'),
+    'python2': ('python', 'pip'),
+    'python': ('python', 'pip'),
+}
 
 
-def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+def start_clone(url):
+    return subprocess.Popen(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
-    if r.returncode == 0:
+
+def finish_clone(proc):
+    if proc.wait() == 0:
         return True
     else:
         print("[COUT] Git clone error: Invalid argument to exit",
@@ -22,38 +35,14 @@ def git_clone(url):
         return False
 
 
-def get_pip_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'pip3'
-
-    return 'pip'
-
-
-def get_python_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'python3'
-
-    return 'python'
-
-
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'nose'])
+def init_env(pip_cmd):
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'nose'])
 
 
-def validate_version(version):
-    valid_version = ['python', 'python2', 'python3', 'py3k']
-    if version not in valid_version:
-        print("[COUT] Check version failed: the valid version is {}".format(valid_version), file=sys.stderr)
-        return False
-
-    return True
-
-
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -62,8 +51,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root=REPO_PATH, depth=1):
+    # finds what REPO_PATH/setup.py ... REPO_PATH/*/requirements_dev.txt would
+    # match, reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif entry.name in ('requirements.txt', 'requirements_dev.txt'):
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -73,7 +89,8 @@ def pip_install(file_name, version='py3k'):
 
 
 def nose(file_name):
-    r = safe_command.run(subprocess.run, 'cd {}/{}; nosetests --with-xunit --xunit-file=/tmp/output.xml'.format(REPO_PATH, file_name), shell=False)
+    r = safe_command.run(subprocess.run, ['nosetests', '--with-xunit', '--xunit-file=/tmp/output.xml'],
+                         cwd='{}/{}'.format(REPO_PATH, file_name))
 
     if r.returncode != 0:
         return False
@@ -100,28 +117,27 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-path', 'version', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
+        if key == 'version' and value not in VERSION_CMDS:
+            print("[COUT] Check version failed: the valid version is {}".format(sorted(VERSION_CMDS)), file=sys.stderr)
+            return None
 
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
 
 def main():
     argv = parse_argument()
+    if argv is None:
+        print("[COUT] CO_RESULT = false")
+        return
+
     git_url = argv.get('git-url')
     if not git_url:
         print("[COUT] The git-url value is null", file=sys.stderr)
@@ -135,33 +151,27 @@ def main():
         return
 
     version = argv.get('version', 'py3k')
+    python_cmd, pip_cmd = VERSION_CMDS[version]
 
-    if not validate_version(version):
-        print("[COUT] CO_RESULT = false")
+    # the clone and the runner install are both network bound; overlap them
+    clone = start_clone(git_url)
+    init_env(pip_cmd)
+    if not finish_clone(clone):
         return
 
-    init_env(version)
-
-    if not git_clone(git_url):
-        return
+    # a failed install would only make the test run fail later
+    continue_on_error = argv.get('continue-on-error', 'false') == 'true'
+    setups, reqs = discover()
 
-    for file_name in glob.glob('{}/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
+    for file_name in setups:
+        if not setup(file_name, python_cmd) and not continue_on_error:
+            print("[COUT] CO_RESULT = false")
+            return
 
-    for file_name in glob.glob('{}/*/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/*/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/requirements_dev.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/*/requirements_dev.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    # one pip run resolves all requirement files together
+    if reqs and not pip_install(reqs, pip_cmd) and not continue_on_error:
+        print("[COUT] CO_RESULT = false")
+        return
 
 
     out = nose(entry_path)
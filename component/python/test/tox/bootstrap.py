@@ -2,16 +2,19 @@
 
 import subprocess
 import os
+import re
 import sys
 import json
-import anymarkup
 from security import safe_command
 
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-path', 'out-put-type'])
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -25,8 +28,7 @@ def git_clone(url):
 def setup(path):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; python3 {} install'.format(dir_name, file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, ['python3', file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed: {}".format(path), file=sys.stderr)
@@ -46,7 +48,8 @@ def pip_install(file_name):
 
 
 def tox(file_name):
-    r = safe_command.run(subprocess.run, 'cd {}/{}; tox --result-json /tmp/output.json'.format(REPO_PATH, file_name), shell=False)
+    r = safe_command.run(subprocess.run, ['tox', '--result-json', '/tmp/output.json'],
+                         cwd='{}/{}'.format(REPO_PATH, file_name))
 
     if r.returncode != 0:
         return False
@@ -55,9 +58,18 @@ def tox(file_name):
 
 
 def echo_json(use_yaml):
+    # yaml is only needed, and imported, for yaml output
+    if use_yaml:
+        import yaml
+        try:
+            from yaml import CSafeDumper as SafeDumper
+        except ImportError:
+            from yaml import SafeDumper
+
     data = json.load(open('/tmp/output.json'))
     if use_yaml:
-        data = anymarkup.serialize(data, 'yaml')
+        data = yaml.dump(data, Dumper=SafeDumper, encoding='utf-8',
+                         default_flow_style=False)
         print('[COUT] CO_YAML_CONTENT {}'.format(str(data)[1:]))
     else:
         print('[COUT] CO_JSON_CONTENT {}'.format(json.dumps(data)))
@@ -70,22 +82,14 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-path', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
@@ -2,16 +2,27 @@
 
 import subprocess
 import os
+import re
 import sys
-import glob
-import anymarkup
+import shutil
+from collections import deque
 from security import safe_command
 
 REPO_PATH = 'git-repo'
+# a key=value pair, or any other token (reported as unknown)
+ARG_RE = re.compile(r'([\w-]+)=(\S+)|\S+')
+VALID_ARGS = frozenset(['git-url', 'entry-module', 'version', 'out-put-type'])
+# version -> (python, pip) commands
+VERSION_CMDS = {
+    'py3k': ('python3', 'pip3'),
+    'python3': ('python3', 'pip3'),
+    'python2': ('python', 'pip'),
+    'python': ('python', 'pip'),
+}
 
 
 def git_clone(url):
-    r = subprocess.run(['git', 'clone', url, REPO_PATH])
+    r = subprocess.run(['git', 'clone', '--depth=1', '--single-branch', url, REPO_PATH])
 
     if r.returncode == 0:
         return True
@@ -22,38 +33,24 @@ def git_clone(url):
         return False
 
 
-def get_pip_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'pip3'
+def installed(python_cmd, module):
+    r = subprocess.run([python_cmd, '-c', 'import {}'.format(module)],
+                       stderr=subprocess.DEVNULL)
+    return r.returncode == 0
 
-    return 'pip'
 
+def init_env(pip_cmd, python_cmd):
+    # skip pip's index round trip when the image already has the runner
+    if installed(python_cmd, 'xmlrunner'):
+        return
 
-def get_python_cmd(version):
-    if version == 'py3k' or version == 'python3':
-        return 'python3'
-
-    return 'python'
-
-
-def init_env(version):
-    safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', 'unittest-xml-reporting'])
-
-
-def validate_version(version):
-    valid_version = ['python', 'python2', 'python3', 'py3k']
-    if version not in valid_version:
-        print("[COUT] Check version failed: the valid version is {}".format(valid_version), file=sys.stderr)
-        return False
-
-    return True
+    safe_command.run(subprocess.run, [pip_cmd, 'install', 'unittest-xml-reporting'])
 
 
-def setup(path, version='py3k'):
+def setup(path, python_cmd='python3'):
     file_name = os.path.basename(path)
     dir_name = os.path.dirname(path)
-    r = safe_command.run(subprocess.run, 'cd {}; {} {} install'.format(dir_name, get_python_cmd(version), file_name),
-                       shell=False)
+    r = safe_command.run(subprocess.run, [python_cmd, file_name, 'install'], cwd=dir_name)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -62,8 +59,35 @@ def setup(path, version='py3k'):
     return True
 
 
-def pip_install(file_name, version='py3k'):
-    r = safe_command.run(subprocess.run, [get_pip_cmd(version), 'install', '-r', file_name])
+def discover(root=REPO_PATH, depth=1):
+    # finds what REPO_PATH/setup.py ... REPO_PATH/*/requirements_dev.txt would
+    # match, reading every directory once
+    setups = []
+    reqs = []
+    dirs = [root]
+    for level in range(depth + 1):
+        subdirs = []
+        for d in dirs:
+            for entry in os.scandir(d):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if level < depth:
+                        subdirs.append(entry.path)
+                elif entry.name == 'setup.py':
+                    setups.append(entry.path)
+                elif entry.name in ('requirements.txt', 'requirements_dev.txt'):
+                    reqs.append(entry.path)
+        dirs = subdirs
+
+    return setups, reqs
+
+
+def pip_install(file_names, pip_cmd='pip3'):
+    cmd = [pip_cmd, 'install']
+    for file_name in file_names:
+        cmd += ['-r', file_name]
+    r = safe_command.run(subprocess.run, cmd)
 
     if r.returncode != 0:
         print("[COUT] install dependences failed", file=sys.stderr)
@@ -72,10 +96,10 @@ def pip_install(file_name, version='py3k'):
     return True
 
 
-def unittest(module, version='py3k'):
-    os.system('cp /root/xmlrunner {}'.format(REPO_PATH))
-    r = safe_command.run(subprocess.run, 'cd {};{} xmlrunner {}'.format(REPO_PATH,
-        get_python_cmd(version), module), shell=False)
+def unittest(module, python_cmd='python3'):
+    shutil.copy('/root/xmlrunner', REPO_PATH)
+    r = safe_command.run(subprocess.run, [python_cmd, 'xmlrunner', module],
+                         cwd=REPO_PATH)
 
     if r.returncode != 0:
         return False
@@ -83,19 +107,33 @@ def unittest(module, version='py3k'):
     return True
 
 
+def iter_files(root, suffix):
+    if not os.path.isdir(root):
+        return
+
+    stack = deque([root])
+    while stack:
+        for entry in os.scandir(stack.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False) and entry.name.endswith(suffix):
+                yield entry.path
+
+
 def echo_xml(use_yaml):
-    for root, dirs, files in os.walk('/tmp/output'):
-        for file_name in files:
-            file = os.path.join(root, file_name)
-            if use_yaml:
-                data = anymarkup.parse_file(file)
-                data = anymarkup.serialize(data, 'yaml')
-                print('[COUT] CO_YAML_CONTENT {}'.format(str(data)[1:]))
-                continue
-            if file_name.endswith('.xml'):
-                with open(file, 'rb') as f:
-                    data = f.read()
-                    print('[COUT] CO_XML_CONTENT {}'.format(str(data)[1:]))
+    # anymarkup is only needed, and imported, for yaml output
+    if use_yaml:
+        import anymarkup
+
+    for file in iter_files('/tmp/output', '.xml'):
+        if use_yaml:
+            data = anymarkup.parse_file(file)
+            data = anymarkup.serialize(data, 'yaml')
+            print('[COUT] CO_YAML_CONTENT {}'.format(str(data)[1:]))
+            continue
+        with open(file, 'rb') as f:
+            data = f.read()
+            print('[COUT] CO_XML_CONTENT {}'.format(str(data)[1:]))
 
     return True
 
@@ -105,28 +143,27 @@ def parse_argument():
     if not data:
         return {}
 
-    validate = ['git-url', 'entry-module', 'version', 'out-put-type']
     ret = {}
-    for s in data.split(' '):
-        s = s.strip()
-        if not s:
-            continue
-        arg = s.split('=')
-        if len(arg) < 2:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
-            continue
-
-        if arg[0] not in validate:
-            print('[COUT] Unknown Parameter: [{}]'.format(s))
+    for m in ARG_RE.finditer(data):
+        key, value = m.group(1, 2)
+        if key not in VALID_ARGS:
+            print('[COUT] Unknown Parameter: [{}]'.format(m.group(0)))
             continue
+        if key == 'version' and value not in VERSION_CMDS:
+            print("[COUT] Check version failed: the valid version is {}".format(sorted(VERSION_CMDS)), file=sys.stderr)
+            return None
 
-        ret[arg[0]] = arg[1]
+        ret[key] = value
 
     return ret
 
 
 def main():
     argv = parse_argument()
+    if argv is None:
+        print("[COUT] CO_RESULT = false")
+        return
+
     git_url = argv.get('git-url')
     if not git_url:
         print("[COUT] The git-url value is null", file=sys.stderr)
@@ -134,12 +171,8 @@ def main():
         return
 
     version = argv.get('version', 'py3k')
-
-    if not validate_version(version):
-        print("[COUT] CO_RESULT = false")
-        return
-
-    init_env(version)
+    python_cmd, pip_cmd = VERSION_CMDS[version]
+    init_env(pip_cmd, python_cmd)
 
     entry_module = argv.get('entry-module')
     if not entry_module:
@@ -150,26 +183,17 @@ def main():
     if not git_clone(git_url):
         return
 
-    for file_name in glob.glob('{}/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/*/setup.py'.format(REPO_PATH)):
-        setup(file_name, version)
-
-    for file_name in glob.glob('{}/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
-
-    for file_name in glob.glob('{}/*/requirements.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    setups, reqs = discover()
 
-    for file_name in glob.glob('{}/requirements_dev.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    for file_name in setups:
+        setup(file_name, python_cmd)
 
-    for file_name in glob.glob('{}/*/requirements_dev.txt'.format(REPO_PATH)):
-        pip_install(file_name, version)
+    # one pip run resolves all requirement files together
+    if reqs:
+        pip_install(reqs, pip_cmd)
 
 
-    out = unittest(entry_module, version)
+    out = unittest(entry_module, python_cmd)
 
     use_yaml = argv.get('out-put-type', 'json') == 'yaml'
 